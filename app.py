@@ -12,26 +12,91 @@ Funcionalidades:
 - Exportação Excel com múltiplas abas (Base_Limpa, Resumo_Status, Resumo_OS, Falhas_Upgrade)
   com formatação amigável (freeze panes, largura auto, num_format).
 
-Dependências: streamlit, pandas, openpyxl (leitura), XlsxWriter (escrita recomendada).
+Dependências: streamlit, pandas, python-calamine (leitura rápida; fallback openpyxl),
+XlsxWriter (escrita recomendada).
 """
 
 from __future__ import annotations
 
 import io
+import math
+import os
 import re
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from typing import Dict, Tuple
 
 import numpy as np
 import pandas as pd
 import streamlit as st
-from pandas.api.types import is_float_dtype, is_integer_dtype
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+from pandas.api.types import is_datetime64_any_dtype, is_float_dtype, is_integer_dtype
 
 
 # ==============================
 # Helpers de Exportação (XLSX)
 # ==============================
 
+def _int_width(n: int) -> int:
+    """Quantidade de dígitos de um inteiro não negativo."""
+    if n == 0:
+        return 1
+    # math.log10 aceita int de qualquer tamanho (np.log10 falha acima de uint64)
+    d = int(math.log10(n)) + 1
+    # log10 em float pode arredondar para cima perto de potências de 10 (ex.: 10**15 - 1)
+    return d - 1 if 10 ** (d - 1) > n else d
+
+def _num_len(abs_max: float, decimals: int, thousands: bool = True) -> int:
+    """Largura de abs_max formatado como f"{x:,.Nf}" (sem sinal), sem gerar a string."""
+    d = _int_width(int(round(abs_max, decimals)))
+    seps = (d - 1) // 3 if thousands else 0
+    return d + seps + (decimals + 1 if decimals else 0)
+
+def _data_width(series: pd.Series) -> int:
+    """
+    Estima a largura (em caracteres) dos dados de uma coluna, de forma vetorizada.
+    Para números, calcula a largura do maior valor absoluto (com milhar/decimais)
+    aritmeticamente, sem formatar nenhuma célula.
+    """
+    values = series.dropna()
+    if values.empty:
+        return 0
+
+    if is_float_dtype(values) or is_integer_dtype(values):
+        max_abs = float(values.abs().max())
+        if not np.isfinite(max_abs):
+            return 0
+        sign = 1 if values.min() < 0 else 0
+        decimals = 2 if is_float_dtype(values) else 0
+        return _num_len(max_abs, decimals) + sign
+
+    # Datas saem no datetime_format do writer ("yyyy-mm-dd HH:MM:SS"); astype("string")
+    # em timestamp Arrow renderia o ISO com nanossegundos e superestimaria a largura
+    if is_datetime64_any_dtype(values):
+        return len("yyyy-mm-dd HH:MM:SS")
+
+    return int(values.astype("string").str.len().max() or 0)
+
+def _excel_frame(df: pd.DataFrame) -> Tuple[pd.DataFrame, list]:
+    """
+    Prepara um DataFrame para escrita sem copiá-lo: devolve (df, nomes de coluna).
+    Só materializa um frame novo (raso) se houver index nomeado a levar para colunas.
+    """
+    # Se tiver index nomeado, leva para colunas
+    if df.index.names is not None and any(n is not None for n in df.index.names):
+        df = df.reset_index()
+
+    # Achata MultiIndex em colunas (ex.: ("Métrica","Status","Base"))
+    # (to_excel não aceita MultiIndex com index=False)
+    if isinstance(df.columns, pd.MultiIndex):
+        cols = [" - ".join(map(str, tup)).strip(" -") for tup in df.columns]
+        df = df.set_axis(cols, axis=1)
+    else:
+        cols = [str(c) for c in df.columns]
+    return df, cols
+
 def df_to_xlsx_bytes(
     sheets: Dict[str, pd.DataFrame],
     sample_for_width: int = 1000,
@@ -53,17 +118,8 @@ def df_to_xlsx_bytes(
         with pd.ExcelWriter(output, engine="xlsxwriter", datetime_format="yyyy-mm-dd HH:MM:SS") as writer:
             for name, df in sheets.items():
                 sheet = (name or "Sheet1")[:31]
-                _df = df.copy()
-
-                # Achata MultiIndex em colunas (ex.: ("Métrica","Status","Base"))
-                if isinstance(_df.columns, pd.MultiIndex):
-                    _df.columns = [" - ".join(map(str, tup)).strip() for tup in _df.columns]
-
-                # Se tiver index nomeado, leva para colunas
-                if _df.index.names is not None and any(n is not None for n in _df.index.names):
-                    _df = _df.reset_index()
-
-                _df.to_excel(writer, sheet_name=sheet, index=False)
+                _df, cols = _excel_frame(df)
+                _df.to_excel(writer, sheet_name=sheet, index=False, header=cols)
 
                 workbook = writer.book
                 worksheet = writer.sheets[sheet]
@@ -79,24 +135,31 @@ def df_to_xlsx_bytes(
                 n = min(len(_df), sample_for_width)
                 sample_df = _df.head(n)
 
-                for col_idx, col_name in enumerate(_df.columns):
-                    series = sample_df[col_name]
-                    header_len = len(str(col_name))
-
-                    # Aplicar formatação e estimar largura
-                    if is_float_dtype(_df[col_name]):
-                        worksheet.set_column(col_idx, col_idx, None, fmt_float)
-                        formatted = series.dropna().map(lambda x: f"{x:,.2f}")
-                        data_len = formatted.map(len).max() if not formatted.empty else 0
-                    elif is_integer_dtype(_df[col_name]):
-                        worksheet.set_column(col_idx, col_idx, None, fmt_int)
-                        formatted = series.dropna().map(lambda x: f"{int(x):,d}")
-                        data_len = formatted.map(len).max() if not formatted.empty else 0
+                # Largura + formato de cada coluna, aplicados depois num único set_column
+                specs = []
+                for col_idx, col_name in enumerate(cols):
+                    series = sample_df.iloc[:, col_idx]
+                    header_len = len(col_name)
+
+                    # Formatação e largura estimada
+                    if is_float_dtype(series):
+                        fmt = fmt_float
+                    elif is_integer_dtype(series):
+                        fmt = fmt_int
                     else:
-                        data_len = series.astype(str).map(len).max() if not series.empty else 0
+                        fmt = None
+                    data_len = _data_width(series)
 
                     best = min(max(header_len, int(data_len or 0)) + 2, 60)
-                    worksheet.set_column(col_idx, col_idx, best)
+                    specs.append((best, fmt))
+
+                # Colunas contíguas com mesma largura/formato viram um só set_column
+                first = 0
+                for col_idx in range(1, len(specs) + 1):
+                    if col_idx == len(specs) or specs[col_idx] != specs[first]:
+                        best, fmt = specs[first]
+                        worksheet.set_column(first, col_idx - 1, best, fmt)
+                        first = col_idx
 
         return output.getvalue()
 
@@ -106,15 +169,8 @@ def df_to_xlsx_bytes(
         with pd.ExcelWriter(output, engine="openpyxl", datetime_format="yyyy-mm-dd HH:MM:SS") as writer:
             for name, df in sheets.items():
                 sheet = (name or "Sheet1")[:31]
-                _df = df.copy()
-
-                if isinstance(_df.columns, pd.MultiIndex):
-                    _df.columns = [" - ".join(map(str, tup)).strip() for tup in _df.columns]
-
-                if _df.index.names is not None and any(n is not None for n in _df.index.names):
-                    _df = _df.reset_index()
-
-                _df.to_excel(writer, sheet_name=sheet, index=False)
+                _df, cols = _excel_frame(df)
+                _df.to_excel(writer, sheet_name=sheet, index=False, header=cols)
                 ws = writer.sheets[sheet]
 
                 # Congela a 1ª linha
@@ -124,10 +180,9 @@ def df_to_xlsx_bytes(
                 n = min(len(_df), sample_for_width)
                 sample_df = _df.head(n)
 
-                for col_idx, col_name in enumerate(_df.columns, start=1):
-                    header_len = len(str(col_name))
-                    series = sample_df[col_name]
-                    data_len = series.astype(str).map(len).max() if not series.empty else 0
+                for col_idx, col_name in enumerate(cols, start=1):
+                    header_len = len(col_name)
+                    data_len = _data_width(sample_df.iloc[:, col_idx - 1])
                     best = min(max(header_len, int(data_len or 0)) + 2, 60)
                     ws.column_dimensions[get_column_letter(col_idx)].width = best
 
@@ -138,84 +193,150 @@ def df_to_xlsx_bytes(
 # Parsing / Limpeza Cortex
 # ==============================
 
-_CANDIDATE_COLS = {
+_CANDIDATE_COLS = frozenset({
     "Endpoint Name",
     "Endpoint Type",
     "Operating System",
     "Agent Version",
-}
+})
+
+_IPV4_RE = r"\b(\d{1,3}(?:\.\d{1,3}){3})\b"
+_IPV6_RE = r"^(?:[^,]*,)*?\s*([^,]*:[^,]*?)\s*(?:,|$)"
+
+# Palavras-chave de falha de upgrade (compilado uma vez, sem precisar de lower())
+_FAIL_RE = re.compile(r"fail|timed out|faulty|lost|error", re.IGNORECASE)
+
+# Formatos de data vistos nos exports do Cortex (last_seen, last_upgrade_status_time)
+_DATE_FORMATS = ("%Y-%m-%d %H:%M:%S", "%Y-%m-%dT%H:%M:%S", "%d/%m/%Y %H:%M:%S")
+
+# Colunas de baixa cardinalidade: viram category (códigos inteiros nos resumos/dedup)
+_CATEGORY_COLS = ("endpoint_status", "operating_system", "endpoint_type", "last_upgrade_status")
+
+# Quantas linhas do topo da planilha varrer atrás do header
+_HEADER_SCAN_ROWS = 25
 
-def _norm_col(c: str) -> str:
-    c = str(c).strip()
-    c = re.sub(r"[^0-9A-Za-z]+", "_", c)
-    c = re.sub(r"_+", "_", c).strip("_").lower()
-    return c
+def _rewind(file_like) -> None:
+    if hasattr(file_like, "seek"):
+        file_like.seek(0)
+
+def _read_excel(file_like, **kwargs) -> pd.DataFrame:
+    """
+    Lê a 1ª aba do XLSX com o engine calamine (Rust), bem mais rápido que openpyxl.
+    Se python-calamine não estiver instalado, cai para openpyxl.
+    """
+    try:
+        return pd.read_excel(file_like, sheet_name=0, engine="calamine", **kwargs)
+    except ImportError:
+        _rewind(file_like)
+        return pd.read_excel(file_like, sheet_name=0, engine="openpyxl", **kwargs)
+
+def _fast_to_datetime(s: pd.Series) -> pd.Series:
+    """
+    Converte para datetime passando format= quando o 1º valor casa com um dos formatos
+    conhecidos do export (caminho rápido em C); senão, cai na inferência genérica.
+    """
+    if is_datetime64_any_dtype(s):
+        return s
+    sample = s.dropna()
+    if not sample.empty:
+        first = str(sample.iloc[0]).strip()
+        for fmt in _DATE_FORMATS:
+            try:
+                datetime.strptime(first, fmt)
+            except ValueError:
+                continue
+            return pd.to_datetime(s, format=fmt, errors="coerce")
+    return pd.to_datetime(s, errors="coerce")
 
 def detect_header_index(raw: pd.DataFrame) -> int:
     """
     Detecta a linha do header pelo conjunto de colunas típicas do export do Cortex.
     Se não achar, retorna 1 (fallback comum quando há um título na primeira linha).
     """
-    for i, row in raw.iterrows():
-        vals = set(str(x).strip() for x in row.dropna().tolist())
-        if _CANDIDATE_COLS.issubset(vals):
-            return i
-    return 1
+    head = raw.head(_HEADER_SCAN_ROWS).to_numpy(dtype=object)
+    if head.size == 0:
+        return 1
+    cells = np.char.strip(head.astype(str))
+
+    # Nº de candidatos distintos presentes em cada linha (uma comparação vetorizada por
+    # candidato; contar células duplicadas não faria uma linha incompleta "passar")
+    counts = np.zeros(len(cells), dtype=int)
+    for cand in _CANDIDATE_COLS:
+        counts += (cells == cand).any(axis=1)
+
+    hits = np.flatnonzero(counts == len(_CANDIDATE_COLS))
+    return int(hits[0]) if hits.size else 1
+
+def _as_category(df: pd.DataFrame) -> pd.DataFrame:
+    """Converte as colunas de _CATEGORY_COLS presentes em category (no-op se já forem)."""
+    for c in _CATEGORY_COLS:
+        if c in df.columns and not isinstance(df[c].dtype, pd.CategoricalDtype):
+            df[c] = df[c].astype("category")
+    return df
 
 def parse_cortex_excel(file_like) -> Tuple[pd.DataFrame, int]:
     """
     Lê um XLSX do Cortex, detecta header, padroniza colunas/tipos e retorna (df, header_row_idx).
+
+    Leitura em duas passadas: só as primeiras linhas para achar o header e, depois,
+    a planilha a partir dele. Na 2ª passada tudo é lido como object, para que textos
+    numéricos (ex.: agent_version "8.10", códigos com zero à esquerda) continuem texto;
+    só as colunas de data conhecidas são convertidas.
     """
-    # Lê sem header para poder detectar
-    raw = pd.read_excel(file_like, sheet_name=0, header=None, engine="openpyxl")
+    # 1ª passada: só o topo da planilha, sem header, para detectar
+    head = _read_excel(file_like, header=None, nrows=_HEADER_SCAN_ROWS)
+    header_row_idx = detect_header_index(head)
 
-    header_row_idx = detect_header_index(raw)
-    hdr = raw.iloc[header_row_idx].tolist()
-    df = raw.iloc[header_row_idx + 1:].copy()
-    df.columns = hdr
+    # 2ª passada: planilha a partir da linha de header (sem inferência de tipos)
+    _rewind(file_like)
+    df = _read_excel(file_like, header=0, skiprows=header_row_idx, dtype=object)
 
     # Remove colunas e linhas totalmente vazias
     df = df.dropna(axis=1, how="all").dropna(how="all")
 
-    # Padroniza nomes
-    df.columns = [_norm_col(c) for c in df.columns]
+    # Padroniza nomes (snake_case) numa única passada vetorizada sobre o Index;
+    # o "+" do padrão já colapsa sequências de separadores num só "_"
+    df.columns = (
+        pd.Index(df.columns).astype(str)
+        .str.replace(r"[^0-9A-Za-z]+", "_", regex=True)
+        .str.strip("_").str.lower()
+    )
 
     # Converte datas
     for col in ("last_seen", "last_upgrade_status_time"):
         if col in df.columns:
-            df[col] = pd.to_datetime(df[col], errors="coerce")
+            df[col] = _fast_to_datetime(df[col])
 
     # Normaliza status (title case)
     if "endpoint_status" in df.columns:
         df["endpoint_status"] = (
-            df["endpoint_status"].astype(str).str.strip().str.title()
+            df["endpoint_status"].astype("string").str.strip().str.title()
         )
 
-    # Extrai 1º IPv4 e 1º IPv6 se houverem múltiplos por célula
-    ipv4_re = re.compile(r"\b(\d{1,3}(?:\.\d{1,3}){3})\b")
-
+    # Extrai 1º IPv4 e 1º IPv6 se houverem múltiplos por célula (vetorizado, via .str)
     if "ip_address" in df.columns:
-        def _first_ipv4(x):
-            if pd.isna(x):
-                return np.nan
-            m = ipv4_re.search(str(x))
-            return m.group(1) if m else np.nan
-        df["ipv4"] = df["ip_address"].apply(_first_ipv4)
+        df["ipv4"] = df["ip_address"].astype("string").str.extract(_IPV4_RE, expand=False)
 
     if "ipv6_address" in df.columns:
-        def _first_ipv6(x):
-            if pd.isna(x):
-                return np.nan
-            # captura a primeira sequência que contenha ':'
-            for part in [p.strip() for p in str(x).split(",") if p.strip()]:
-                if ":" in part:
-                    return part
-            return np.nan
-        df["ipv6"] = df["ipv6_address"].apply(_first_ipv6)
+        # captura a primeira sequência (separada por vírgula) que contenha ':'
+        df["ipv6"] = df["ipv6_address"].astype("string").str.extract(_IPV6_RE, expand=False)
+
+    # Strings em buffers Arrow (bem mais enxutos que objetos str do Python)
+    df = df.convert_dtypes(dtype_backend="pyarrow")
+    df = _as_category(df)
 
     return df, int(header_row_idx)
 
 
+def _recency_ns(s: pd.Series) -> np.ndarray:
+    """
+    Datas como int64 (ns, UTC sem tz) para ordenar por recência. Normaliza colunas com
+    timezone (ex.: ISO com "Z") ou offsets mistos antes de tirar a view int64.
+    """
+    ts = pd.to_datetime(s, errors="coerce", utc=True).dt.tz_localize(None)
+    return ts.astype("datetime64[ns]").to_numpy().view("i8")
+
+
 def unify_cortex(
     df: pd.DataFrame,
     dedup_on=("endpoint_name", "endpoint_alias"),
@@ -230,43 +351,44 @@ def unify_cortex(
       - Resumo_OS (se disponível)
       - Falhas_Upgrade (se houver)
     """
-    df_in = df.copy()
-
     # Dedup: mais recente vence
-    if all(c in df_in.columns for c in dedup_on):
-        sort_cols = [c for c in ("last_seen", "last_upgrade_status_time") if c in df_in.columns]
+    # (take/drop_duplicates já devolvem frames novos; não precisa copiar a entrada)
+    if all(c in df.columns for c in dedup_on):
+        sort_cols = [c for c in ("last_seen", "last_upgrade_status_time") if c in df.columns]
         if sort_cols:
-            df_in = df_in.sort_values(sort_cols, ascending=False)
-        base_limpa = df_in.drop_duplicates(subset=list(dedup_on), keep="first")
+            # Chave única de recência = max(last_seen, last_upgrade_status_time), em int64
+            # (NaT vira o menor int64, então fica por último). ~ts ordena decrescente
+            # sem overflow e mantém a ordem original nos empates (argsort estável).
+            ts = np.maximum.reduce([_recency_ns(df[c]) for c in sort_cols])
+            df = df.take(np.argsort(~ts, kind="stable"))
+        base_limpa = df.drop_duplicates(subset=list(dedup_on), keep="first")
     else:
-        base_limpa = df_in.drop_duplicates()
+        base_limpa = df.drop_duplicates()
 
     # Resumos
     if "endpoint_status" in base_limpa.columns:
         resumo_status = (
-            base_limpa.groupby("endpoint_status", dropna=False)
-            .size().reset_index(name="qtd")
-            .sort_values("qtd", ascending=False)
+            base_limpa["endpoint_status"].value_counts(dropna=False)
+            .loc[lambda vc: vc > 0]  # category lista também as categorias sem linhas
+            .rename_axis("endpoint_status").reset_index(name="qtd")
         )
     else:
         resumo_status = pd.DataFrame()
 
     if "operating_system" in base_limpa.columns:
         resumo_os = (
-            base_limpa.groupby("operating_system", dropna=False)
-            .size().reset_index(name="qtd")
-            .sort_values("qtd", ascending=False)
+            base_limpa["operating_system"].value_counts(dropna=False)
+            .loc[lambda vc: vc > 0]  # category lista também as categorias sem linhas
+            .rename_axis("operating_system").reset_index(name="qtd")
         )
     else:
         resumo_os = pd.DataFrame()
 
     # Falhas de upgrade
-    fail_mask = pd.Series(False, index=base_limpa.index)
+    fail_mask = np.zeros(len(base_limpa), dtype=bool)
     for col in ("last_upgrade_status", "last_upgrade_failure_reason"):
         if col in base_limpa.columns:
-            fail_mask = fail_mask | base_limpa[col].astype(str).str.lower().str.contains(
-                "fail|timed out|faulty|lost|error", na=False
-            )
+            fail_mask |= base_limpa[col].astype("string").str.contains(_FAIL_RE, na=False).to_numpy(dtype=bool)
     falhas_upg = base_limpa[fail_mask].copy()
 
     sheets = {"Base_Limpa": base_limpa}
@@ -280,6 +402,40 @@ def unify_cortex(
     return sheets
 
 
+# ==============================
+# Cache (Streamlit)
+# ==============================
+
+# Caches limitados: cada entrada guarda DataFrames (ou o XLSX) na memória do servidor
+_CACHE_TTL = 3600  # segundos
+
+@st.cache_data(show_spinner=False, max_entries=32, ttl=_CACHE_TTL)
+def _parse_cached(name: str, blob: bytes) -> Tuple[pd.DataFrame, int]:
+    """
+    parse_cortex_excel com cache pelo conteúdo do upload (nome + bytes):
+    reprocessar com os mesmos arquivos não relê as planilhas.
+
+    O upload é gravado uma vez num arquivo temporário e o parser recebe o caminho,
+    que o calamine abre direto do disco (sem reler um BytesIO a cada passada).
+    """
+    with tempfile.NamedTemporaryFile(suffix=".xlsx", delete=False) as tf:
+        tf.write(blob)
+        path = tf.name
+    try:
+        return parse_cortex_excel(path)
+    finally:
+        os.unlink(path)
+
+@st.cache_data(show_spinner=False, max_entries=8, ttl=_CACHE_TTL)
+def _unify_cached(base: pd.DataFrame, dedup_on: Tuple[str, ...]) -> Dict[str, pd.DataFrame]:
+    return unify_cortex(base, dedup_on=dedup_on)
+
+@st.cache_data(show_spinner=False, max_entries=4, ttl=_CACHE_TTL)
+def _xlsx_cached(sheets: Dict[str, pd.DataFrame]) -> bytes:
+    """df_to_xlsx_bytes com cache: só o 1º processamento de cada resultado gera o Excel."""
+    return df_to_xlsx_bytes(sheets)
+
+
 # ==============================
 # UI - Streamlit
 # ==============================
@@ -315,21 +471,29 @@ if not uploads:
 elif processar:
     # Parseia todos e concatena
     with st.spinner("Lendo e normalizando os arquivos..."):
-        parsed_dfs = []
-        header_rows = []
-        for up in uploads:
-            df_parsed, hdr_idx = parse_cortex_excel(up)
-            parsed_dfs.append(df_parsed)
-            header_rows.append(hdr_idx)
-
-        base = pd.concat(parsed_dfs, ignore_index=True) if len(parsed_dfs) > 1 else parsed_dfs[0]
+        # Arquivos em paralelo; limitado a 4 workers porque a memória cresce com a concorrência.
+        # Os workers recebem o contexto do script (st.cache_data o exige em outras threads).
+        ctx = get_script_run_ctx()
+        with ThreadPoolExecutor(
+            max_workers=min(len(uploads), 4),
+            initializer=lambda: add_script_run_ctx(threading.current_thread(), ctx),
+        ) as ex:
+            results = list(ex.map(lambda up: _parse_cached(up.name, up.getvalue()), uploads))
+        parsed_dfs = [r[0] for r in results]
+        header_rows = [r[1] for r in results]
+
+        if len(parsed_dfs) > 1:
+            # concat de categories com categorias diferentes vira object; reconverte
+            base = _as_category(pd.concat(parsed_dfs, ignore_index=True))
+        else:
+            base = parsed_dfs[0]
 
         # Info rápida
         total_linhas = len(base)
         st.success(f"Arquivos lidos: **{len(uploads)}** · Linhas combinadas: **{total_linhas:,}** · Headers detectados: {header_rows}")
 
     with st.spinner("Unificando, deduplicando e gerando resumos..."):
-        sheets = unify_cortex(base, dedup_on=tuple(dedup_key))
+        sheets = _unify_cached(base, tuple(dedup_key))
         base_limpa = sheets.get("Base_Limpa", pd.DataFrame())
         resumo_status = sheets.get("Resumo_Status", pd.DataFrame())
         resumo_os = sheets.get("Resumo_OS", pd.DataFrame())
@@ -364,7 +528,8 @@ elif processar:
     # Downloads
     st.divider()
     st.subheader("Exportar")
-    xlsx_bytes = df_to_xlsx_bytes(sheets)
+    with st.spinner("Gerando o Excel..."):
+        xlsx_bytes = _xlsx_cached(sheets)
     st.download_button(
         "⬇️ Baixar Excel Unificado (XLSX)",
         data=xlsx_bytes,